@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 """
 1. Generate chamber.geo from parameters
-2. Call gmsh -3 to produce chamber.stl
-3. Show a Matplotlib preview (blue = inlet tube, green = full mesh plate,
+2. Call gmsh -3 to produce chamber.stl (skipped if chamber.geo is unchanged)
+3. Render a Matplotlib preview (blue = inlet tube, green = full mesh plate,
    red = outlet) so you can eyeball the geometry before meshing in OpenFOAM.
+   Saved to chamber_preview.png by default; CFD_PREVIEW=show opens the
+   interactive window instead. Skipped with --no-preview.
 """
-import subprocess, pathlib, textwrap, numpy as np, matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+import subprocess, pathlib, textwrap, hashlib, math, os, argparse, numpy as np
+
+ap = argparse.ArgumentParser(description=__doc__,
+                             formatter_class=argparse.RawDescriptionHelpFormatter)
+ap.add_argument("--no-preview", dest="preview", action="store_false",
+                help="only write the STL, skip the Matplotlib preview")
+args = ap.parse_args()
 
 # ---------- user‑tunable numbers (mm) --------------------
 params = dict(
@@ -19,6 +26,7 @@ params = dict(
 here = pathlib.Path(__file__).parent.resolve()
 geo_path = here / "chamber.geo"
 stl_path = here / "chamber.stl"
+stamp_path = here / "chamber.stl.sha256"   # hash of the .geo the STL was built from
 
 # ---------- write chamber.geo ----------------------------
 geo_template = f"""
@@ -44,60 +52,92 @@ Physical Surface("walls")  = Surface "*";
 Characteristic Length{{PointsOf{{Volume{{1}};}}}} = 2.0;
 Mesh.CharacteristicLengthExtend = 0;
 """
-geo_path.write_text(textwrap.dedent(geo_template))
-
-# ---------- call gmsh ------------------------------------
-subprocess.check_call(["gmsh", "-3", "-format", "stl",
-                       "-o", str(stl_path), str(geo_path)])
-
-print(f"✓  STL written to {stl_path}")
+geo_text = textwrap.dedent(geo_template)
+if not geo_path.exists() or geo_path.read_text() != geo_text:
+    geo_path.write_text(geo_text)   # leave mtime alone on no-op reruns
+gmsh_opts = ["-3", "-bin", "-format", "stl"]   # binary STL: smaller, faster to read
+geo_hash = hashlib.sha256((geo_text + " ".join(gmsh_opts)).encode()).hexdigest()
+
+# ---------- call gmsh (skipped if the .geo is unchanged) --
+if stl_path.exists() and stamp_path.exists() and stamp_path.read_text() == geo_hash:
+    print(f"✓  STL up to date, reusing {stl_path}")
+else:
+    stamp_path.unlink(missing_ok=True)   # a failed run must not leave a valid stamp
+    subprocess.check_call(["gmsh", *gmsh_opts, "-nt", str(os.cpu_count() or 1),
+                           "-o", str(stl_path), str(geo_path)])
+    stamp_path.write_text(geo_hash)
+    print(f"✓  STL written to {stl_path}")
 
 # ---------- quick 3‑D preview -----------------------------
+def _norm3(v):
+    # length of a 3-vector without going through np.linalg dispatch
+    return math.sqrt(float(v[0]*v[0] + v[1]*v[1] + v[2]*v[2]))
+
 def cyl_faces(base, vec, r, n=48):
     # returns side faces for plotting
-    z = vec/np.linalg.norm(vec)
+    z = vec/_norm3(vec)
     # find two perpendicular vectors
     x = np.cross([0,0,1], z) if abs(z[2])<0.99 else np.cross([0,1,0], z)
-    x /= np.linalg.norm(x)
+    x /= _norm3(x)
     y = np.cross(z, x)
     t = np.linspace(0, 2*np.pi, n, endpoint=False)
-    c0 = np.array([base + r*(np.cos(th)*x + np.sin(th)*y) for th in t])
+    c0 = base + r*(np.cos(t)[:,None]*x + np.sin(t)[:,None]*y)   # (n,3)
     c1 = c0 + vec
-    return [[c0[i], c0[(i+1)%n], c1[(i+1)%n], c1[i]] for i in range(n)]
-
-fig = plt.figure(figsize=(6,5))
-ax = fig.add_subplot(111, projection='3d')
-ax.set_box_aspect([params['lx'], params['ly'], params['lz']])
-
-# chamber wireframe
-for xs in [[0, params['lx']]]:
-    for ys in [[0, params['ly']]]:
-        ax.plot([xs[0], xs[1], xs[1], xs[0], xs[0]],
-                [ys[0], ys[0], ys[1], ys[1], ys[0]],
-                [0, 0, 0, 0, 0], color='k', alpha=0.3)
-        ax.plot([xs[0], xs[1], xs[1], xs[0], xs[0]],
-                [ys[0], ys[0], ys[1], ys[1], ys[0]],
-                [params['lz']]*5, color='k', alpha=0.3)
-for x in (0, params['lx']):
-    for y in (0, params['ly']):
-        ax.plot([x, x],[y, y],[0, params['lz']], color='k', alpha=0.3)
-
-# inlet tube
-faces = cyl_faces(np.array([4,10,2]), np.array([0,0, params['tube_len']]), params['tube_id']/2)
-ax.add_collection3d(Poly3DCollection(faces, facecolor='skyblue', alpha=0.6))
-
-# outlet tube
-faces = cyl_faces(np.array([26,10,params['lz']]),
-                  np.array([0,0,-params['out_depth']]), params['out_id']/2)
-ax.add_collection3d(Poly3DCollection(faces, facecolor='salmon', alpha=0.6))
-
-# mesh plate (draw both faces for visibility)
-mx = params['mesh_x']; th = params['mesh_thk']; ly = params['ly']; lz = params['lz']
-plate = [[mx-th/2, 0, 0],[mx+th/2, 0, 0],[mx+th/2, ly, 0],[mx-th/2, ly, 0],
-         [mx-th/2, 0, lz],[mx+th/2, 0, lz],[mx+th/2, ly, lz],[mx-th/2, ly, lz]]
-faces = [[plate[0],plate[1],plate[2],plate[3]],
-         [plate[4],plate[5],plate[6],plate[7]]]
-ax.add_collection3d(Poly3DCollection(faces, facecolor='forestgreen', alpha=0.4))
-
-ax.set_xlabel('x (mm)'); ax.set_ylabel('y (mm)'); ax.set_zlabel('z (mm)')
-ax.set_title('Quick geometry preview'); plt.tight_layout(); plt.show()
+    nxt = np.roll(np.arange(n), -1)
+    return np.stack([c0, c0[nxt], c1[nxt], c1], axis=1)         # (n,4,3)
+
+def preview():
+    show = os.environ.get("CFD_PREVIEW", "save") == "show"
+    import matplotlib
+    if not show:
+        matplotlib.use("Agg")   # no GUI toolkit needed just to write a PNG
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_rgba
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection, Line3DCollection
+
+    fig = plt.figure(figsize=(6,5))
+    ax = fig.add_subplot(111, projection='3d')
+    ax.set_box_aspect([params['lx'], params['ly'], params['lz']])
+    ax.set_xlim(0, params['lx']); ax.set_ylim(0, params['ly']); ax.set_zlim(0, params['lz'])
+
+    # chamber wireframe (12 box edges in one collection)
+    corners = np.array([[x, y, z] for z in (0, params['lz'])
+                                  for y in (0, params['ly'])
+                                  for x in (0, params['lx'])], dtype=float)
+    edges = corners[[[0,1],[2,3],[4,5],[6,7],     # along x
+                     [0,2],[1,3],[4,6],[5,7],     # along y
+                     [0,4],[1,5],[2,6],[3,7]]]    # along z  -> (12,2,3)
+    ax.add_collection3d(Line3DCollection(edges, colors='k', alpha=0.3))
+
+    # inlet tube
+    inlet = cyl_faces(np.array([4,10,2]), np.array([0,0, params['tube_len']]), params['tube_id']/2)
+
+    # outlet tube
+    outlet = cyl_faces(np.array([26,10,params['lz']]),
+                       np.array([0,0,-params['out_depth']]), params['out_id']/2)
+
+    # mesh plate (draw both faces for visibility)
+    mx = params['mesh_x']; th = params['mesh_thk']; ly = params['ly']; lz = params['lz']
+    plate = np.array([[mx-th/2, 0, 0],[mx+th/2, 0, 0],[mx+th/2, ly, 0],[mx-th/2, ly, 0],
+                      [mx-th/2, 0, lz],[mx+th/2, 0, lz],[mx+th/2, ly, lz],[mx-th/2, ly, lz]],
+                     dtype=float)
+    plate = plate[[[0,1,2,3],[4,5,6,7]]]   # (2,4,3)
+
+    # all surfaces in one collection, colour (with alpha) per group
+    groups = [(inlet, 'skyblue', 0.6), (outlet, 'salmon', 0.6), (plate, 'forestgreen', 0.4)]
+    faces = np.concatenate([f for f, _, _ in groups])
+    colors = np.concatenate([np.tile(to_rgba(c, a), (len(f), 1)) for f, c, a in groups])
+    ax.add_collection3d(Poly3DCollection(faces, facecolors=colors))
+
+    ax.set_xlabel('x (mm)'); ax.set_ylabel('y (mm)'); ax.set_zlabel('z (mm)')
+    ax.set_title('Quick geometry preview'); plt.tight_layout()
+    if show:
+        plt.show()
+    else:
+        png_path = here / "chamber_preview.png"
+        fig.savefig(png_path, dpi=96, bbox_inches="tight")
+        plt.close(fig)
+        print(f"✓  Preview saved to {png_path}")
+
+if args.preview:
+    preview()
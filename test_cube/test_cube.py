@@ -2,34 +2,75 @@
 """
 Self-contained unit-test for a 5 mm cube CFD case using OpenFOAM-9:
 1. Generates case directories and dictionaries (with proper FoamFile headers).
-2. Runs blockMesh and simpleFoam.
-3. Samples centerline velocity.
-4. Compares against analytical Poiseuille within 3%.
+2. Runs blockMesh, then simpleFoam in parallel (decomposePar/mpirun/reconstructPar).
+3. Samples centerline velocity (in the background, see solve()/verify()).
+4. Compares against analytical square-duct Poiseuille flow within 3%.
 """
+import os
 import subprocess
 import pathlib
 import shutil
 import textwrap
-import numpy as np
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Helper to run shell commands
 def run(cmd, cwd=None):
     print(f">>> {' '.join(cmd)}")
     subprocess.check_call(cmd, cwd=cwd)
 
+# Same, but return immediately; the caller waits on the Popen handle
+def run_async(cmd, cwd=None):
+    print(f">>> {' '.join(cmd)} &")
+    return subprocess.Popen(cmd, cwd=cwd)
+
 # Set up paths
 test_dir = pathlib.Path(__file__).parent.resolve()
 case_dir = test_dir / "case"
 
-# Remove existing case and prepare directories
-def prepare_case():
-    if case_dir.exists():
-        shutil.rmtree(case_dir)
-    (case_dir / "system").mkdir(parents=True)
-    (case_dir / "constant").mkdir()
-    (case_dir / "0").mkdir()
+# Inlet (mean) velocity in m/s; also scales the analytical profile
+u_in = 0.001
+
+# MPI ranks for simpleFoam; a 20^3 block doesn't benefit from more than a few
+n_procs = min(4, os.cpu_count() or 1)
+
+# Trash directories with a deletion thread running, guarded by _trash_lock
+_deleting = set()
+_trash_lock = threading.Lock()
+
+def _delete_in_background(trash):
+    def work():
+        shutil.rmtree(trash, ignore_errors=True)
+        with _trash_lock:
+            _deleting.discard(trash)
+    with _trash_lock:
+        if trash in _deleting:
+            return
+        _deleting.add(trash)
+    threading.Thread(target=work, daemon=True).start()
+
+# Remove existing case and prepare directories. The old case is renamed
+# aside (one syscall) and deleted in a background thread. Leftovers from
+# runs that exited before their cleanup finished are swept up too, but only
+# when no deletion is in progress, so no tree gets two threads.
+def prepare_case(case=case_dir):
+    with _trash_lock:
+        idle = not _deleting
+    if idle:
+        for trash in case.parent.glob(".trash.*"):
+            _delete_in_background(trash)
+    if case.exists():
+        trash = case.with_name(f".trash.{uuid.uuid4().hex}")
+        os.rename(case, trash)
+        _delete_in_background(trash)
+    (case / "system").mkdir(parents=True)
+    (case / "constant").mkdir()
+    (case / "0").mkdir()
 
-# FoamFile header template
+# FoamFile header template (memoised: only a handful of object names)
+@lru_cache(maxsize=None)
 def foam_header(obj_name):
     return textwrap.dedent(f"""
 FoamFile
@@ -42,10 +83,8 @@ FoamFile
 // * * * * * * * * * * * * * * * * * * * * * //
 """)
 
-# Write all dictionaries
-def write_dictionaries():
-    # system/blockMeshDict
-    blockMeshDict = textwrap.dedent("""
+# Dictionary bodies, dedented once at import
+_BLOCK_MESH_DICT = textwrap.dedent("""
 convertToMeters 0.001;
 vertices (
     (0 0 0)
@@ -71,12 +110,8 @@ boundary (
     ); }
 );
 """)
-    (case_dir / "system" / "blockMeshDict").write_text(
-        foam_header("blockMeshDict") + blockMeshDict
-    )
 
-    # system/fvSchemes
-    fvSchemes = textwrap.dedent("""
+_FV_SCHEMES = textwrap.dedent("""
 ddtSchemes
 {
     default         steadyState;
@@ -104,12 +139,8 @@ snGradSchemes
     default         corrected;
 }
 """)
-    (case_dir / "system" / "fvSchemes").write_text(
-        foam_header("fvSchemes") + fvSchemes
-    )
 
-    # system/fvSolution
-    fvSolution = textwrap.dedent("""
+_FV_SOLUTION = textwrap.dedent("""
 solvers
 {
     p
@@ -130,6 +161,11 @@ solvers
 SIMPLE
 {
     nNonOrthogonalCorrectors 0;
+    residualControl
+    {
+        p               1e-4;
+        U               1e-5;
+    }
 }
 
 relaxationFactors
@@ -144,56 +180,43 @@ relaxationFactors
     }
 }
 """)
-    (case_dir / "system" / "fvSolution").write_text(
-        foam_header("fvSolution") + fvSolution
-    )
 
-        # system/controlDict
-    controlDict = textwrap.dedent("""
+_CONTROL_DICT = textwrap.dedent("""
 application     simpleFoam;
 startFrom       startTime;
 startTime       0;
-endTime         200;
+endTime         2000;
 deltaT          1;
 writeControl    timeStep;
-writeInterval   200;
+writeInterval   2000;
 purgeWrite      0;
+writeFormat     binary;
+writeCompression off;
+timeFormat      general;
 """)
-    (case_dir / "system" / "controlDict").write_text(
-        foam_header("controlDict") + controlDict
-    )
 
-    # constant/transportProperties
-    transportProperties = textwrap.dedent("""
+_DECOMPOSE_PAR_DICT = textwrap.dedent(f"""
+numberOfSubdomains {n_procs};
+method          scotch;
+""")
+
+_TRANSPORT_PROPERTIES = textwrap.dedent("""
 transportModel  Newtonian;
 nu              [0 2 -1 0 0 0 0] 1e-6;
 """)
-    (case_dir / "constant" / "transportProperties").write_text(
-        foam_header("transportProperties") + transportProperties
-    )
-
-        # constant/momentumTransport (required by this build)
-    (case_dir / "constant" / "momentumTransport").write_text(
-        foam_header("momentumTransport") + "simulationType laminar;\n"
-    )
 
-    # 0/U
-    U_field = textwrap.dedent("""
+_U_FIELD = textwrap.dedent(f"""
 dimensions      [0 1 -1 0 0 0 0];
-internalField   uniform (0.001 0 0);
+internalField   uniform ({u_in} 0 0);
 boundaryField
-{
-    inlet  { type fixedValue; value uniform (0.001 0 0); }
-    outlet { type zeroGradient; }
-    walls  { type noSlip; }
-}
+{{
+    inlet  {{ type fixedValue; value uniform ({u_in} 0 0); }}
+    outlet {{ type zeroGradient; }}
+    walls  {{ type noSlip; }}
+}}
 """)
-    (case_dir / "0" / "U").write_text(
-        foam_header("U") + U_field
-    )
 
-    # 0/p
-    p_field = textwrap.dedent("""
+_P_FIELD = textwrap.dedent("""
 dimensions      [0 2 -2 0 0 0 0];
 internalField   uniform 0;
 boundaryField
@@ -203,51 +226,113 @@ boundaryField
     walls  { type zeroGradient; }
 }
 """)
-    (case_dir / "0" / "p").write_text(
-        foam_header("p") + p_field
-    )
-
-    # system/sampleDict
-    sampleDict = textwrap.dedent("""
-FoamFile
-{
-    version     2.0;
-    format      ascii;
-    class       dictionary;
-    object      sampleDict;
-}
 
+_SAMPLE_DICT = textwrap.dedent("""
 interpolationScheme cellPoint;
-sets ( centerLine uniform (0 2.5 2.5) (5 2.5 2.5) 100 );
+sets ( centerLine uniform (4.5 0 2.5) (4.5 5 2.5) 20 );
 fields ( U );
 """)
-    (case_dir / "system" / "sampleDict").write_text(sampleDict)
 
-# Main execution
-def main():
-    prepare_case()
-    write_dictionaries()
+_MOMENTUM_TRANSPORT = "simulationType laminar;\n"   # required by this build
+
+# (path relative to case_dir, FoamFile object name, body)
+_FILES = [
+    ("system/blockMeshDict",         "blockMeshDict",       _BLOCK_MESH_DICT),
+    ("system/fvSchemes",             "fvSchemes",           _FV_SCHEMES),
+    ("system/fvSolution",            "fvSolution",          _FV_SOLUTION),
+    ("system/controlDict",           "controlDict",         _CONTROL_DICT),
+    ("system/decomposeParDict",      "decomposeParDict",    _DECOMPOSE_PAR_DICT),
+    ("constant/transportProperties", "transportProperties", _TRANSPORT_PROPERTIES),
+    ("constant/momentumTransport",   "momentumTransport",   _MOMENTUM_TRANSPORT),
+    ("0/U",                          "U",                   _U_FIELD),
+    ("0/p",                          "p",                   _P_FIELD),
+    ("system/sampleDict",            "sampleDict",          _SAMPLE_DICT),
+]
+
+# Write all dictionaries
+def write_dictionaries(case=case_dir):
+    def write(entry):
+        rel, obj_name, body = entry
+        (case / rel).write_text(foam_header(obj_name) + body)
+    # small independent files: overlap the I/O; list() re-raises any error
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        list(ex.map(write, _FILES))
+
+# Cases whose postProcess is still running (started by solve(), not yet
+# collected by verify())
+_sampling = set()
+
+# Set up, mesh and solve a case, then start sampling in the background.
+# Returns (postProcess handle, case) so a sweep can prepare the next case
+# while this one is still being sampled; pass it to verify() to finish.
+# Overlapped cases must live in distinct directories: preparing a case
+# moves its old directory away, so reusing one mid-sampling is refused.
+def solve(case=case_dir):
+    case = pathlib.Path(case).resolve()
+    if case in _sampling:
+        raise RuntimeError(f"{case} is still being sampled; verify() it first "
+                           "or use a different case directory")
+    prepare_case(case)
+    write_dictionaries(case)
 
     # 1) Mesh & solve
-    run(["blockMesh", "-case", str(case_dir)])
-    run(["simpleFoam", "-case", str(case_dir)])
+    run(["blockMesh", "-case", str(case)])
+    if n_procs > 1:
+        run(["decomposePar", "-case", str(case)])
+        run(["mpirun", "-np", str(n_procs), "simpleFoam", "-parallel",
+             "-case", str(case)])
+        run(["reconstructPar", "-case", str(case), "-latestTime"])
+    else:
+        run(["simpleFoam", "-case", str(case)])
 
     # 2) Sample centreline
-    run(["postProcess", "-case", str(case_dir), "-func", "sample"])
+    pp_proc = run_async(["postProcess", "-case", str(case), "-func", "sample", "-latestTime"])
+    _sampling.add(case)
+    return pp_proc, case
+
+# Fully developed laminar velocity on the mid-plane (z = centre) of a square
+# duct, Shah & London series; eta = -1..1 across the duct, scaled so the
+# cross-section mean is u_mean (centreline comes out at 2.096*u_mean)
+def duct_profile(eta, u_mean, n_terms=50):
+    import numpy as np
+    n = np.arange(1, 2*n_terms, 2)[:, None]
+    sign = np.where((n - 1) % 4 == 0, 1.0, -1.0)
+    u = (sign / n**3 * (1 - 1/np.cosh(n*np.pi/2)) * np.cos(n*np.pi*eta/2)).sum(axis=0)
+    mean = (2/(np.pi*n**4) * (1 - 2/(n*np.pi) * np.tanh(n*np.pi/2))).sum()
+    return u_mean * u / mean
+
+# Wait for sampling to finish and compare against the analytical profile
+def verify(job):
+    pp_proc, case = job
+    pp_proc.wait()
+    _sampling.discard(case)
+    if pp_proc.returncode != 0:
+        raise subprocess.CalledProcessError(pp_proc.returncode, pp_proc.args)
 
-    # 3) Load sampled data and compare
-    data_file = case_dir / "postProcessing" / "sets" / "200" / "centerLine_U.xy"
-    data = np.loadtxt(data_file)
-    x = data[:,0]
-    u_num = data[:,2]  # Ux component
+    # 3) Load sampled data and compare. numpy is only needed from here on,
+    # so importers of prepare_case() etc. and early failures don't pay for it.
+    import numpy as np
 
-    # Analytical parabolic profile
-    u_max = u_num.max()
-    u_analytic = u_max * (1 - (x/5)**2)
+    # residualControl stops simpleFoam (and writes) at whatever iteration
+    # it converges, so take the last set.
+    sets_dir = case / "postProcessing" / "sets"
+    time_dir = max(sets_dir.iterdir(), key=lambda d: float(d.name))
+    data_file = time_dir / "centerLine_U.xy"
+    # raw set layout is "coord Ux Uy Uz"; only parse the coordinate and Ux.
+    # The line crosses the duct in y near the outlet, where the flow is
+    # fully developed, so the coordinate (distance from y=0) is y.
+    y, u_num = np.loadtxt(data_file, usecols=(0, 1), dtype=np.float64, unpack=True)
+
+    # Analytical profile from the inlet (mean) velocity, not the sample itself
+    u_analytic = duct_profile((y - 2.5)/2.5, u_in)
     err = np.linalg.norm(u_num - u_analytic) / np.linalg.norm(u_analytic)
     print(f"relative L2 error = {err:.3%}")
-    assert err < 0.03, "Velocity deviates >3% from Poiseuille"
+    assert err < 0.03, "Velocity deviates >3% from square-duct Poiseuille"
     print("✔ unit test passed")
 
+# Main execution
+def main():
+    verify(solve())
+
 if __name__ == '__main__':
     main()